@@ -286,7 +286,7 @@ class Sphere(Structure):
 
         rad  = r - radius
 
-        super(Sphere, self).__init__(p=np.array(pts) * rad, r=np.ones(n_sphere_point)*radius)
+        super(Sphere, self).__init__(p=np.array(pts) * rad, r=np.full(n_sphere_point, radius, dtype=float))
 
         self.properties['p1'] = 1.0  # squeezing coeff on x axis
         self.properties['p2'] = 1.0  # squeezing coeff on y axis
@@ -556,13 +556,16 @@ class Density(Structure):
         x_ = np.arange(-m, m + 1, 1).astype(int)
         y_ = np.arange(-n, n + 1, 1).astype(int)
         z_ = np.arange(-k, k + 1, 1).astype(int)
-        x, y, z = np.meshgrid(x_, y_, z_)
 
-        h = np.exp(-(x * x + y * y) / (2. * sigma * sigma))
-        h[h < np.finfo(h.dtype).eps * h.max()] = 0
+        # the kernel is separable: build it as outer product of 1D gaussians
+        # (varying along the first two axes, constant along the third one)
+        g = np.exp(-(x_ * x_) / (2. * sigma * sigma))
+        h = np.multiply.outer(np.multiply.outer(g, g), np.ones(len(z_)))
+        # drop negligible values, and normalize
+        np.multiply(h, h >= np.finfo(h.dtype).eps * h.max(), out=h)
         sumh = h.sum()
         if sumh != 0:
-            h /= sumh
+            h *= 1.0 / sumh
 
         dens = scipy.ndimage.filters.convolve(self.properties['density'], h, mode='constant')
         self.properties['density'] = dens
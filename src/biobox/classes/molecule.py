@@ -26,6 +26,7 @@ c = 3.336 * 10**(-30) # conversion from debye to e m
 Na = 6.022 * 10**(23) # Avagadros Number
 
 from biobox.classes.structure import Structure
+from biobox.classes.density import Density
 from biobox.lib import e_density
 
 class Molecule(Structure):
@@ -619,7 +620,7 @@ class Molecule(Structure):
         self.data = pd.DataFrame(data, index=idx, columns=cols)
 
         #add additional information about van der waals radius and atoms charge
-        self.data['radius'] = np.ones(len(d_data)) * self.know('atom_vdw')['.']
+        self.data['radius'] = np.full(len(d_data), self.know('atom_vdw')['.'], dtype=float)
         self.data['charge'] = np.zeros(len(d_data))
 
         fin.close()
@@ -685,7 +686,6 @@ class Molecule(Structure):
 
         # print 'one entry in dens is: \n%s'%dens[35][27][20]
 
-        from biobox.classes.density import Density
         D = Density()
         D.properties['density'] = dens
         D.properties['size'] = np.array(dens.shape)
@@ -768,8 +768,13 @@ class Molecule(Structure):
 
             it.iternext()
 
-        # convolve point mesh with 3d coulomb hyperbola
-        e = scipy.signal.fftconvolve(d, kernel, mode='same')
+        # convolve point mesh with 3d coulomb hyperbola. When FFT is the
+        # fastest option, overlap-add avoids a single FFT over the whole box
+        method = scipy.signal.choose_conv_method(d, kernel, mode='same')
+        if method == 'fft':
+            e = scipy.signal.oaconvolve(d, kernel, mode='same')
+        else:
+            e = scipy.signal.convolve(d, kernel, mode='same', method=method)
 
         # define mass-occupied space
         # mass_density is Density-object, buff=buff makes shure that the
@@ -809,7 +814,6 @@ class Molecule(Structure):
 
         # prepare density data structure for both positive and negative maps at
         # once
-        from biobox.classes.density import Density
         D_pos = Density()
         D_neg = Density()
         D_pos.properties['density'] = e_pos
@@ -913,7 +917,7 @@ class Molecule(Structure):
         if "atom_ccs" in self.data.columns:
             return self.data["atom_ccs"]
 
-        ccs = np.ones(len(self.points)) * self.know("atom_ccs")["."]
+        ccs = np.full(len(self.points), self.know("atom_ccs")["."], dtype=float)
         for e in self.know("atom_ccs").keys():
             if "e" != ".":
                 ccs[self.data["atomtype"].values == e] = self.knowledge["atom_ccs"][e]
@@ -11,11 +11,103 @@
 #
 # Author : Matteo Degiacomi, matteo.degiacomi@gmail.com
 
-from copy import deepcopy
+from functools import lru_cache
 import numpy as np
-import scipy.signal
+import scipy.ndimage
 import pandas as pd
 
+def _qcp_rmsd(H, E0, L):
+    '''
+    compute the RMSD between pairs of centered structures after optimal superposition, with the Quaternion Characteristic Polynomial (QCP) method (Theobald, Acta Cryst. A, 2005).
+    Unlike Kabsch algorithm, no SVD is needed, and reflections are implicitly excluded.
+    For (nearly) collinear structures QCP is ill-conditioned: these pairs are evaluated via SVD of their correlation matrix.
+
+    :param H: stack of 3x3 correlation matrices between pairs of structures (nx3x3 numpy array)
+    :param E0: sum of squared coordinates of both structures of every pair (numpy array of length n)
+    :param L: number of points
+    :returns: numpy array of RMSDs
+    '''
+    H = np.asarray(H, dtype=np.float64)
+    Sxx, Sxy, Sxz = H[..., 0, 0], H[..., 0, 1], H[..., 0, 2]
+    Syx, Syy, Syz = H[..., 1, 0], H[..., 1, 1], H[..., 1, 2]
+    Szx, Szy, Szz = H[..., 2, 0], H[..., 2, 1], H[..., 2, 2]
+
+    Sxx2, Syy2, Szz2 = Sxx * Sxx, Syy * Syy, Szz * Szz
+    Sxy2, Syz2, Sxz2 = Sxy * Sxy, Syz * Syz, Sxz * Sxz
+    Syx2, Szy2, Szx2 = Syx * Syx, Szy * Szy, Szx * Szx
+
+    SyzSzymSyySzz2 = 2.0 * (Syz * Szy - Syy * Szz)
+    Sxx2Syy2Szz2Syz2Szy2 = Syy2 + Szz2 - Sxx2 + Syz2 + Szy2
+    Sxy2Sxz2Syx2Szx2 = Sxy2 + Sxz2 - Syx2 - Szx2
+
+    SxzpSzx, SyzpSzy, SxypSyx = Sxz + Szx, Syz + Szy, Sxy + Syx
+    SyzmSzy, SxzmSzx, SxymSyx = Syz - Szy, Sxz - Szx, Sxy - Syx
+    SxxpSyy, SxxmSyy = Sxx + Syy, Sxx - Syy
+
+    C2 = -2.0 * (Sxx2 + Syy2 + Szz2 + Sxy2 + Syx2 + Sxz2 + Szx2 + Syz2 + Szy2)
+    C1 = 8.0 * (Sxx * Syz * Szy + Syy * Szx * Sxz + Szz * Sxy * Syx
+                - Sxx * Syy * Szz - Syz * Szx * Sxy - Szy * Syx * Sxz)
+    C0 = (Sxy2Sxz2Syx2Szx2 * Sxy2Sxz2Syx2Szx2
+          + (Sxx2Syy2Szz2Syz2Szy2 + SyzSzymSyySzz2) * (Sxx2Syy2Szz2Syz2Szy2 - SyzSzymSyySzz2)
+          + (-SxzpSzx * SyzmSzy + SxymSyx * (SxxmSyy - Szz)) * (-SxzmSzx * SyzpSzy + SxymSyx * (SxxmSyy + Szz))
+          + (-SxzpSzx * SyzpSzy - SxypSyx * (SxxpSyy - Szz)) * (-SxzmSzx * SyzmSzy - SxypSyx * (SxxpSyy + Szz))
+          + (SxypSyx * SyzpSzy + SxzpSzx * (SxxmSyy + Szz)) * (-SxymSyx * SyzmSzy + SxzpSzx * (SxxpSyy + Szz))
+          + (SxypSyx * SyzmSzy + SxzmSzx * (SxxmSyy - Szz)) * (-SxymSyx * SyzpSzy + SxzmSzx * (SxxpSyy - Szz)))
+
+    # largest root of the characteristic polynomial x^4 + C2 x^2 + C1 x + C0
+    # found by Newton-Raphson, starting from its upper bound E0/2
+    lmax = np.array(E0 / 2.0, dtype=np.float64)
+    for _ in range(50):
+        x2 = lmax * lmax
+        b = (x2 + C2) * lmax
+        a = b + C1
+        num = np.asarray(a * lmax + C0)
+        den = np.asarray(2.0 * x2 * lmax + b + a)
+        delta = np.divide(num, den, out=np.zeros(num.shape), where=den != 0)
+        lmax = lmax - delta
+        if np.all(np.abs(delta) <= 1e-11 * np.abs(lmax)):
+            break
+
+    # the polynomial derivative at lmax vanishes when lmax is a multiple root
+    # (collinear structures), making the root very sensitive to rounding.
+    # In this case, fall back on Kabsch (sum of singular values, last one
+    # changing sign for reflections)
+    x3 = lmax * lmax * lmax
+    dP = 4.0 * x3 + 2.0 * C2 * lmax + C1
+    degenerate = ~(np.abs(dP) >= 1e-2 * np.abs(x3))
+    if np.any(degenerate):
+        S = np.linalg.svd(H[degenerate], compute_uv=False)
+        S[np.linalg.det(H[degenerate]) < 0, -1] *= -1
+        lmax[degenerate] = S.sum(axis=1)
+
+    return np.sqrt(np.abs(E0 - 2.0 * lmax) / L)
+
+def _normalize_index(points_index):
+    '''
+    convert a points selection into a single index expression, usable to slice coordinates.
+
+    :param points_index: list or numpy array of point indices. If empty, all points are selected
+    :returns: slice selecting all points if no index is provided, numpy array of indices otherwise
+    '''
+    if len(points_index) == 0:
+        return slice(None)
+
+    if isinstance(points_index, list) or type(points_index).__module__ == 'numpy':
+        idx = np.asarray(points_index)
+        if idx.dtype == bool:
+            return idx # boolean mask
+        return idx.astype(np.intp, copy=False)
+
+    raise Exception("ERROR: give me a list of indices to compute RMSD, or nothing at all, please!")
+
+@lru_cache(maxsize=None)
+def _density_class():
+    '''
+    :returns: :func:`Density <density.Density>` class. Imported on first call, as density module depends on this one.
+    '''
+    from biobox.classes.density import Density
+    return Density
+
 class Structure(object):
     '''
     A Structure consists of an ensemble of points in 3D space, and metadata associated to each of them.
@@ -31,10 +123,9 @@ class Structure(object):
         '''
         if p.ndim == 3:
             self.coordinates = p
-            '''numpy array containing an ensemble of alternative coordinates in 3D space'''
 
         elif p.ndim == 2:
-            self.coordinates = np.array([p])
+            self.coordinates = p[np.newaxis].copy()
         else:
             raise Exception("ERROR: expected numpy array with 2 or three dimensions, but %s dimensions were found" %p.ndim)
 
@@ -55,10 +146,47 @@ class Structure(object):
             if len(r) > 0:
                 self.data = pd.DataFrame(r, index=idx, columns=["radius"])
         else:
-                rad = r*np.ones(len(self.points))
+                rad = np.full(len(self.points), r, dtype=float)
                 self.data = pd.DataFrame(rad, index=idx, columns=["radius"])
                 ''' metadata about each atom (pandas Dataframe)'''
 
+    @property
+    def coordinates(self):
+        '''numpy array containing an ensemble of alternative coordinates in 3D space'''
+        return self._coordinates[:self._nframes]
+
+    @coordinates.setter
+    def coordinates(self, value):
+        # frames are stored in a buffer that may be larger than the amount of
+        # conformations actually available (see add_xyz). Keeping it as a
+        # C-contiguous double precision array lets every transformation run
+        # on BLAS fast paths (no copy is made if value is already so).
+        self._coordinates = np.ascontiguousarray(value, dtype=np.float64)
+        self._nframes = len(value)
+
+    def __getstate__(self):
+        # store only the available frames: the spare rows of the buffer are
+        # uninitialized, and a shallow copy must not share them
+        state = self.__dict__.copy()
+        if '_coordinates' in state:
+            state['_coordinates'] = self.coordinates
+        return state
+
+    def __setstate__(self, state):
+        # objects pickled before the coordinates buffer was introduced
+        # store their frames as 'coordinates'
+        state = dict(state)
+        if 'coordinates' in state:
+            coords = state.pop('coordinates')
+            state['_coordinates'] = np.ascontiguousarray(coords, dtype=np.float64)
+            state['_nframes'] = len(coords)
+
+        # copy and pickle duplicate self.points as an independent array:
+        # restore it as a view on the current frame, so both stay in sync
+        self.__dict__.update(state)
+        if '_coordinates' in state and 'current' in state:
+            self.points = self.coordinates.view()[self.current]
+
     def __len__(self, dim="atoms"):
         if dim == "atoms":
             return len(self.points)
@@ -98,8 +226,8 @@ class Structure(object):
 
         :param coords: array of 3D points
         '''
-        self.coordinates[self.current] = deepcopy(coords)
-        #self.points = self.coordinates[self.current]
+        # slice assignment copies data into the current frame
+        self.coordinates[self.current] = coords
         self.points = self.coordinates.view()[self.current]
 
     def add_xyz(self, coords):
@@ -112,20 +240,21 @@ class Structure(object):
         # coordinates in 3D space
 
         if self.coordinates.size == 0 and coords.ndim == 3:
-            self.coordinates = deepcopy(coords)
+            self.coordinates = coords.copy()
             self.set_current(0)
 
         elif self.coordinates.size == 0 and coords.ndim == 2:
-            self.coordinates = deepcopy(np.array([coords]))
+            self.coordinates = coords[np.newaxis].copy()
             self.set_current(0)
 
         elif self.coordinates.size > 0 and coords.ndim == 3:
-            self.coordinates = np.concatenate((self.coordinates, coords))
+            self._append_frames(coords)
             # set new frame to the first of the newly inserted ones
             self.set_current(self.current + 1)
 
         elif self.coordinates.size > 0 and coords.ndim == 2:
-            self.coordinates = np.concatenate((self.coordinates, np.array([coords])))
+            # a single frame is copied straight into the coordinates buffer
+            self._append_frames(coords[np.newaxis])
             # set new frame to the first of the newly inserted ones
             self.set_current(self.current + 1)
 
@@ -133,6 +262,25 @@ class Structure(object):
             raise Exception("ERROR: expected numpy array with 2 or three dimensions, but %s dimensions were found" %np.ndim)
 
 
+    def _append_frames(self, coords):
+        '''
+        append frames to the coordinates buffer. When the buffer is full, its capacity is doubled,
+        so that adding conformations one at a time does not copy the whole ensemble at every call.
+
+        :param coords: array of arrays of 3D points
+        '''
+        if coords.shape[1:] != self._coordinates.shape[1:]:
+            raise Exception("ERROR: expected conformations of shape %s, but %s was found" %(self._coordinates.shape[1:], coords.shape[1:]))
+
+        n = self._nframes + len(coords)
+        if n > len(self._coordinates):
+            buf = np.empty((max(n, 2 * len(self._coordinates)),) + self._coordinates.shape[1:], dtype=np.float64)
+            buf[:self._nframes] = self._coordinates[:self._nframes]
+            self._coordinates = buf
+
+        self._coordinates[self._nframes:n] = coords
+        self._nframes = n
+
     def delete_xyz(self, index):
         '''
         remove one conformation from the conformations database.
@@ -171,14 +319,11 @@ class Structure(object):
             self.get_center()
 
         # translate all points
-        self.properties['center'][0] += x
-        self.properties['center'][1] += y
-        self.properties['center'][2] += z
+        t = np.array([x, y, z], dtype=float)
+        self.properties['center'] += t
 
-        # move every frame with first :
-        self.coordinates[:, :, 0] += x
-        self.coordinates[:, :, 1] += y
-        self.coordinates[:, :, 2] += z
+        # move every frame at once (broadcasting over frames and points)
+        self.coordinates[:] += t
 
     def rotate(self, x, y, z):
         '''
@@ -192,32 +337,36 @@ class Structure(object):
         :param y: rotation around y axis
         :param z: rotation around z axis
         '''
-        alpha = np.radians(x)
-        beta = np.radians(y)
-        gamma = np.radians(z)
-        Rx = np.array([[1, 0, 0],
-                       [0, np.cos(alpha), - np.sin(alpha)],
-                       [0, np.sin(alpha), np.cos(alpha)]])
-        Ry = np.array([[np.cos(beta), 0, np.sin(beta)],
-                       [0, 1, 0],
-                       [-np.sin(beta), 0, np.cos(beta)]])
-        Rz = np.array([[np.cos(gamma), -np.sin(gamma), 0],
-                       [np.sin(gamma), np.cos(gamma), 0],
-                       [0, 0, 1]])
-        rotation = np.dot(Rx, np.dot(Ry, Rz))
+        ca, sa = np.cos(np.radians(x)), np.sin(np.radians(x))
+        cb, sb = np.cos(np.radians(y)), np.sin(np.radians(y))
+        cg, sg = np.cos(np.radians(z)), np.sin(np.radians(z))
+
+        # transpose of the composed rotation Rx.Ry.Rz, written out explicitly
+        rotation_T = np.array([[cb * cg, ca * sg + sa * sb * cg, sa * sg - ca * sb * cg],
+                               [-cb * sg, ca * cg - sa * sb * sg, sa * cg + ca * sb * sg],
+                               [sb, -sa * cb, ca * cb]])
+
         # multiply rotation matrix with each point of the ellipsoid
-        self.apply_transformation(rotation.T)
+        self.apply_transformation(rotation_T)
         self.get_center()
 
-    def apply_transformation(self, M):
+    def apply_transformation(self, M, all_frames=False):
         '''
         apply a 3x3 transformation matrix
 
         :param M: 3x3 transformation matrix (2D numpy array)
+        :param all_frames: if True, transform all the alternative conformations at once, otherwise only the current one
         '''
-        self.coordinates[self.current, :, :] = np.dot(self.points, M)
-        # new memory allocated? Pointer needs to be moved
-        #self.points = self.coordinates[self.current]
+        if all_frames:
+            # stack all frames into a single (frames*points)x3 matrix, and
+            # transform them with one matrix product
+            flat = self.coordinates.reshape(-1, 3)
+            self.coordinates[:] = np.dot(flat, M).reshape(self.coordinates.shape)
+        else:
+            # result is written straight into the current frame
+            np.matmul(self.points, M, out=self.coordinates[self.current])
+
+        # make sure the pointer refers to the current frame
         self.points = self.coordinates.view()[self.current]
 
     def get_center(self):
@@ -244,12 +393,7 @@ class Structure(object):
 
         .. note: points radii are not kept into account.
         '''
-        x = np.max(self.points[:, 0]) - np.min(self.points[:, 0])
-        # +self.properties['radius']*2
-        y = np.max(self.points[:, 1]) - np.min(self.points[:, 1])
-        # +self.properties['radius']*2
-        z = np.max(self.points[:, 2]) - np.min(self.points[:, 2])
-        return np.array([x, y, z])
+        return np.ptp(self.points, axis=0)
 
     def rotation_matrix(self, axis, theta):
         '''
@@ -282,30 +426,24 @@ class Structure(object):
         # method taken from chempy source code, geometry.py, method
         # getMomentOfInertiaTensor()
 
-        # compute moment of inertia tensor
-        I0 = np.zeros((3, 3), np.float64)
-        for i in range(0, len(self.points), 1):
-            mass = 1  # self.mass[atom] / constants.Na
-            I0[0, 0] += mass * (self.points[i, 1] * self.points[i, 1] + self.points[i, 2] * self.points[i, 2])
-            I0[1, 1] += mass * (self.points[i, 0] * self.points[i, 0] + self.points[i, 2] * self.points[i, 2])
-            I0[2, 2] += mass * (self.points[i, 0] * self.points[i, 0] + self.points[i, 1] * self.points[i, 1])
-            I0[0, 1] -= mass * self.points[i, 0] * self.points[i, 1]
-            I0[0, 2] -= mass * self.points[i, 0] * self.points[i, 2]
-            I0[1, 2] -= mass * self.points[i, 1] * self.points[i, 2]
-
-        I0[1, 0] = I0[0, 1]
-        I0[2, 0] = I0[0, 2]
-        I0[2, 1] = I0[1, 2]
+        # compute moment of inertia tensor (unit masses) from the six sums of
+        # products of coordinates. Each is a single dot product between
+        # columns, with no temporary array. Accumulate in double precision,
+        # whatever the type of the coordinates.
+        pts = self.points.astype(np.float64, copy=False)
+        x, y, z = pts[:, 0], pts[:, 1], pts[:, 2]
+        xx, yy, zz = np.dot(x, x), np.dot(y, y), np.dot(z, z)
+        xy, xz, yz = np.dot(x, y), np.dot(x, z), np.dot(y, z)
+        I0 = np.array([[yy + zz, -xy, -xz],
+                       [-xy, xx + zz, -yz],
+                       [-xz, -yz, xx + yy]])
 
         # Calculate and return the principal moments of inertia and corresponding
-        # principal axes for the current geometry.
-        e_values, e_vectors = np.linalg.eig(I0)
-
-        indices = np.argsort(e_values)
-        e_values = e_values[indices]
-        e_vectors = e_vectors.T[indices]
+        # principal axes for the current geometry. The tensor is symmetric, and
+        # eigh returns eigenvalues already sorted in ascending order.
+        e_values, e_vectors = np.linalg.eigh(I0)
 
-        return e_vectors
+        return e_vectors.T
 
     def align_axes(self):
         '''
@@ -333,29 +471,20 @@ class Structure(object):
         # get principal axes (ranked from smallest to biggest)
         axes = self.get_principal_axes()
 
-        # align smallest principal axis against z axis
-        rotvec = np.cross(axes[0], np.array([1, 0, 0]))  # rotation axis
-        sine = np.linalg.norm(rotvec)
-        cosine = np.dot(axes[0], np.array([1, 0, 0]))
-        angle = np.arctan2(sine, cosine)  # angle to rotate around axis
+        # principal axes are orthonormal: the matrix having them as columns
+        # brings first axis on x, second on y and third on z in a single
+        # step. Flip the third axis if needed, so that this is a proper
+        # rotation (no reflection).
+        rotmatrix0 = axes.T
+        if np.linalg.det(rotmatrix0) < 0:
+            rotmatrix0[:, 2] *= -1
 
-        rotmatrix0 = self.rotation_matrix(rotvec, angle)
         self.apply_transformation(rotmatrix0)
 
-        # compute new principal axes (after previous rotation)
-        axes = self.get_principal_axes()
-
-        # align second principal axis against y axis
-        rotvec = np.cross(axes[1], np.array([0, 1, 0]))  # rotation axis
-        sine = np.linalg.norm(rotvec)
-        cosine = np.dot(axes[1], np.array([0, 1, 0]))
-        angle = np.arctan2(sine, cosine)  # angle to rotate around axis
-
-        rotmatrix1 = self.rotation_matrix(rotvec, angle)
-        self.apply_transformation(rotmatrix1)
-
-        # return the center and matrix for backmapping
-        # do the opposite of these transformations
+        # return the center and matrices for backmapping
+        # do the opposite of these transformations. Alignment is now performed
+        # with a single rotation, the second matrix is kept for compatibility.
+        rotmatrix1 = np.identity(3)
         return c, rotmatrix0, rotmatrix1
 
     def write_pdb(self, filename, index=[]):
@@ -376,33 +505,31 @@ class Structure(object):
             else:
                 raise Exception("ERROR: requested coordinate index %s, but only %s are available" %(np.max(index), len(self.coordinates)))
 
-        fout = open(filename, "w")
+        # Build our hexidecimal array if num. of atoms > 99999
+        idx_val = np.arange(1, self.coordinates.shape[1] + 1, 1)
 
-        for f in frames:
+        if len(idx_val) > 99999:
+            vhex = np.vectorize(hex)
+            idx_val = vhex(idx_val)   # convert index values to hexidecimal
+            idx_val = [num[2:] for num in idx_val]  # remove 0x at start of hexidecimal number
 
-            # Build our hexidecimal array if num. of atoms > 99999
-            idx_val = np.arange(1, self.coordinates.shape[1] + 1, 1)
-
-            if len(idx_val) > 99999:
-                vhex = np.vectorize(hex)
-                idx_val = vhex(idx_val)   # convert index values to hexidecimal
-                idx_val = [num[2:] for num in idx_val]  # remove 0x at start of hexidecimal number
-
-            for i in range(0, len(self.coordinates[0]), 1):
-                #if i > 99999:
-                #    nb = hex(i).split('x')[1]
-                #else:
-                #    nb = str(i)
-
-                l = (idx_val[i], "SPH", "SPH", "A", np.mod(i, 9999),
-                     self.coordinates[f, i, 0],
-                     self.coordinates[f, i, 1],
-                     self.coordinates[f, i, 2],
-                     self.data['radius'].values[i],
-                     1.0, "Z")
-                L = 'ATOM  %5s  %-4s%-4s%1s%4i    %8.3f%8.3f%8.3f%6.2f%6.2f          %2s\n' % l
-                fout.write(L)
+        # fields preceding and following coordinates are identical in every
+        # frame: format them only once, into a template for a whole frame
+        # leaving only coordinates placeholders
+        radius = self.data['radius'].values
+        template = []
+        for i in range(0, len(self.coordinates[0]), 1):
+            head = 'ATOM  %5s  %-4s%-4s%1s%4i    ' % (idx_val[i], "SPH", "SPH", "A", np.mod(i, 9999))
+            tail = '%6.2f%6.2f          %2s\n' % (radius[i], 1.0, "Z")
+            template.append(head.replace("%", "%%") + "%8.3f%8.3f%8.3f" + tail.replace("%", "%%"))
 
+        template = "".join(template)
+
+        fout = open(filename, "w")
+
+        for f in frames:
+            # fill the frame template with a single formatting operation
+            fout.write(template % tuple(self.coordinates[f].ravel().tolist()))
             fout.write("END\n")
 
         fout.close()
@@ -436,51 +563,41 @@ class Structure(object):
         pts = self.points
 
         # rectangular box boundaries
-        bnds = np.array([[np.min(pts[:, 0]) - buff, np.max(pts[:, 0]) + buff],
-                         [np.min(pts[:, 1]) - buff, np.max(pts[:, 1]) + buff],
-                         [np.min(pts[:, 2]) - buff, np.max(pts[:, 2]) + buff]])
+        pmin = np.min(pts, axis=0)
+        bnds = np.stack([pmin - buff, np.max(pts, axis=0) + buff], axis=1)
 
         xax = np.arange(bnds[0, 0], bnds[0, 1] + step, step)
         yax = np.arange(bnds[1, 0], bnds[1, 1] + step, step)
         zax = np.arange(bnds[2, 0], bnds[2, 1] + step, step)
 
-        # create empty box
-        d = np.zeros((len(xax), len(yax), len(zax)))
-
-        # place Kronecker deltas in mesh grid
-        for p in pts:
-            xpos = np.argmin(np.abs(xax - p[0]))
-            ypos = np.argmin(np.abs(yax - p[1]))
-            zpos = np.argmin(np.abs(zax - p[2]))
-            d[xpos, ypos, zpos] = 1
-
-        # create 3d gaussian kernel
-        window = kernel_half_width * 2 + 1
-        shape = (window, window, window)
-
-        m, n, k = [(ss - 1.) / 2. for ss in shape]
-
-        x_ = np.arange(-m, m + 1, 1).astype(int)
-        y_ = np.arange(-n, n + 1, 1).astype(int)
-        z_ = np.arange(-k, k + 1, 1).astype(int)
-        x, y, z = np.meshgrid(x_, y_, z_)
-
-        h = np.exp(-(x * x + y * y + z * z) / (2. * sigma * sigma))
-        h[h < np.finfo(h.dtype).eps * h.max()] = 0
-        sumh = h.sum()
-        if sumh != 0:
-            h /= sumh
-
-        # convolve point mesh with 3d gaussian kernel
-        b = scipy.signal.fftconvolve(d, h, mode='same')
+        # create empty box (single precision is plenty for a smoothed map,
+        # and halves memory traffic during convolution)
+        d = np.zeros((len(xax), len(yax), len(zax)), dtype=np.float32)
+
+        # place Kronecker deltas in mesh grid (index of closest grid node
+        # along each axis). Only the two nodes around each point are tested,
+        # and the upper one is picked only if strictly closer (i.e., ties go
+        # to the lower node, as a search with np.argmin would do)
+        pos = np.empty(pts.shape, dtype=np.intp)
+        for i, ax in enumerate((xax, yax, zax)):
+            lo = np.floor((pts[:, i] - ax[0]) / step).astype(np.intp)
+            np.clip(lo, 0, len(ax) - 1, out=lo)
+            hi = np.minimum(lo + 1, len(ax) - 1)
+            closer = np.abs(ax[hi] - pts[:, i]) < np.abs(ax[lo] - pts[:, i])
+            pos[:, i] = np.where(closer, hi, lo)
+
+        d[pos[:, 0], pos[:, 1], pos[:, 2]] = 1
+
+        # convolve point mesh with 3d gaussian kernel (sigma and half width
+        # in voxels). The kernel is separable: three 1D passes are applied
+        b = scipy.ndimage.gaussian_filter(d, sigma=sigma, mode='constant', truncate=kernel_half_width / float(sigma))
         b /= np.max(b)
 
         # prepare density data structure
-        from biobox.classes.density import Density
-        D = Density()
+        D = _density_class()()
         D.properties['density'] = b
         D.properties['size'] = np.array(b.shape)
-        D.properties['origin'] = np.min(self.points, axis=0) - kernel_half_width / 2.0 + step #np.mean(self.points, axis=0) - step * np.array(b.shape) / 2.0
+        D.properties['origin'] = pmin - kernel_half_width / 2.0 + step #np.mean(self.points, axis=0) - step * np.array(b.shape) / 2.0
         D.properties['delta'] = np.identity(3) * step
         D.properties['format'] = 'dx'
         D.properties['filename'] = ''
@@ -504,16 +621,14 @@ class Structure(object):
         if indices == -1:
             indices = np.linspace(0, len(self.coordinates[0, :, 0]) - 1, len(self.coordinates[0, :, 0])).astype(int)
 
-        means = np.mean(self.coordinates[:, indices], axis=0)
-
-        # cumulate all squared distances with respect of mean
-        d = []
-        for i in range(0, self.coordinates.shape[0], 1):
-            d.append(np.sum((self.coordinates[i, indices] - means)**2, axis=1))
+        pts = self.coordinates[:, indices]
+        diff = pts - np.mean(pts, axis=0)
 
-        # compute square root of sum of mean squared distances
-        dist = np.array(d)
-        return np.sqrt(np.sum(dist, axis=0) / (float(self.coordinates.shape[0]) * step))
+        # cumulate all squared distances with respect of mean (summing over
+        # frames and dimensions at once), and compute square root of sum of
+        # mean squared distances
+        sq = np.einsum('fij,fij->i', diff, diff)
+        return np.sqrt(sq / (float(self.coordinates.shape[0]) * step))
 
     def pca(self, components, indices=-1):
         '''
@@ -527,18 +642,23 @@ class Structure(object):
 
         from sklearn.decomposition import PCA
 
-        # define conformational space (flatten coordinates of desired atoms
+        # define conformational space (flatten coordinates of desired atoms.
+        # Selecting indices creates a new array, that PCA can center in place.
+        # Otherwise, X is a view on coordinates, and must be copied first)
         if indices != -1:
             X = self.coordinates[:, indices].reshape(
                      (len(self.coordinates), len(indices) * 3))
+            copy = False
         else:
             X = self.coordinates.reshape(
                      (self.coordinates.shape[0], self.coordinates.shape[1]*3))
+            copy = True
 
-        # calculate system PCA and project conformations into the eigenspace
-        pca = PCA(n_components=components)
-        pca.fit(X)
-        Xproj = pca.transform(X)
+        # calculate system PCA and project conformations into the eigenspace.
+        # Projections are obtained from the SVD factors of the centered data,
+        # with no further centering or projection of X.
+        pca = PCA(n_components=components, copy=copy)
+        Xproj = pca.fit_transform(X)
 
         return Xproj, pca
 
@@ -558,20 +678,29 @@ class Structure(object):
         bkpcurrent = self.current
 
         if ref_index >= len(self.coordinates):
-            raise Exception("ERROR: index %s requested, but only %s exist in database" %(len(self.coordinates)))
-
-        # define reference frame, and center it
-        if len(points_index) == 0:
-            m1 = deepcopy(self.coordinates[ref_index])
-        elif isinstance(points_index, list) or type(points_index).__module__ == 'numpy':
-            m1 = deepcopy(self.coordinates[ref_index, points_index])
-        else:
-            raise Exception("ERROR: please, provide me with a list of indices to compute RMSD (or no index at all)")
-
-        L = len(m1)
-        COM1 = np.sum(m1, axis=0) / float(L)
-        m1 -= COM1
-        m1sum = np.sum(np.sum(m1 * m1, axis=0), axis=0)
+            raise Exception("ERROR: index %s requested, but only %s exist in database" %(ref_index, len(self.coordinates)))
+
+        # select points of interest in all frames, once
+        sel = _normalize_index(points_index)
+        all_frames = self.coordinates[:, sel]
+
+        # center all frames, and precompute their sum of squares
+        L = all_frames.shape[1]
+        COMs = np.mean(all_frames, axis=1, keepdims=True)
+        centered = all_frames - COMs
+        E0s = np.einsum('fij,fij->f', centered, centered)
+
+        # define reference frame
+        m1 = centered[ref_index]
+        COM1 = COMs[ref_index, 0]
+        m1sum = E0s[ref_index]
+
+        # without alignment no rotation matrix is needed: QCP on all frames at once
+        if not align:
+            H = np.matmul(np.transpose(centered, (0, 2, 1)), m1)
+            RMSD = _qcp_rmsd(H, m1sum + E0s, L)
+            RMSD[ref_index] = 0.0
+            return RMSD
 
         RMSD = []
         for i in range(0, len(self.coordinates), 1):
@@ -580,16 +709,9 @@ class Structure(object):
                 RMSD.append(0.0)
             else:
 
-                # define current frame, and center it
-                if len(points_index) == 0:
-                    m2 = deepcopy(self.coordinates[i])
-                elif isinstance(points_index, list) or type(points_index).__module__ == 'numpy':
-                    m2 = deepcopy(self.coordinates[i, points_index])
-
-                COM2 = np.sum(m2, axis=0) / float(L)
-                m2 -= COM2
-
-                E0 = m1sum + np.sum(np.sum(m2 * m2, axis=0), axis=0)
+                m2 = centered[i]
+                COM2 = COMs[i, 0]
+                E0 = m1sum + E0s[i]
 
                 # This beautiful step provides the answer. V and Wt are the orthonormal
                 # bases that when multiplied by each other give us the rotation matrix, U.
@@ -597,23 +719,21 @@ class Structure(object):
                 # great!
                 V, S, Wt = np.linalg.svd(np.dot(np.transpose(m2), m1))
 
-                # if alignement is required, move pointer to current frame, and
-                # apply rotation matrix
-                if align:
-                    self.set_current(i)
-                    self.coordinates[i] -= COM2 # should center on origin
-                    rotation = np.dot(V, Wt)
-                    self.apply_transformation(rotation)
-                    self.coordinates[i] += COM1 # now should center on reference frame
-
-                reflect = float(
-                    str(float(np.linalg.det(V) * np.linalg.det(Wt))))
-
-                if reflect == -1.0:
+                # V and Wt are orthogonal: their product is a reflection if its
+                # determinant is negative. Correct it before it is applied
+                if np.linalg.det(np.dot(V, Wt)) < 0:
                     S[-1] = -S[-1]
                     V[:, -1] = -V[:, -1]
 
-                rmsdval = E0 - (2.0 * sum(S))
+                # alignement is required: move pointer to current frame, and
+                # apply rotation matrix
+                self.set_current(i)
+                self.coordinates[i] -= COM2 # should center on origin
+                rotation = np.dot(V, Wt)
+                self.apply_transformation(rotation)
+                self.coordinates[i] += COM1 # now should center on reference frame
+
+                rmsdval = E0 - 2.0 * S.sum()
                 rmsdval = np.sqrt(abs(rmsdval / L))
 
                 RMSD.append(rmsdval)
@@ -641,21 +761,13 @@ class Structure(object):
         if j >= len(self.coordinates):
             raise Exception("ERROR: index %s requested, but only %s exist in database" %(j, len(self.coordinates)))
 
+        sel = _normalize_index(points_index)
+
         # get first structure and center it
-        if len(points_index) == 0:
-            m1 = deepcopy(self.coordinates[i])
-        elif isinstance(points_index, list) or type(points_index).__module__ == 'numpy':
-            m1 = deepcopy(self.coordinates[i, points_index])
-        else:
-            raise Exception("ERROR: give me a list of indices to compute RMSD, or nothing at all, please!")
+        m1 = self.coordinates[i, sel].copy()
 
         # get second structure
-        if len(points_index) == 0:
-            m2 = deepcopy(self.coordinates[j])
-        elif isinstance(points_index, list) or type(points_index).__module__ == 'numpy':
-            m2 = deepcopy(self.coordinates[j, points_index])
-        else:
-            raise Exception("ERROR: give me a list of indices to compute RMSD, or nothing at all, please!")
+        m2 = self.coordinates[j, sel].copy()
 
         L = len(m1)
         COM1 = np.sum(m1, axis=0) / float(L)
@@ -672,13 +784,13 @@ class Structure(object):
         # S, (Sigma, from SVD) provides us with the error!  Isn't SVD great!
         V, S, Wt = np.linalg.svd(np.dot(np.transpose(m2), m1))
 
-        reflect = float(str(float(np.linalg.det(V) * np.linalg.det(Wt))))
-
-        if reflect == -1.0:
+        # V and Wt are orthogonal: their product is a reflection if its
+        # determinant is negative
+        if np.linalg.det(np.dot(V, Wt)) < 0:
             S[-1] = -S[-1]
             V[:, -1] = -V[:, -1]
 
-        rmsdval = E0 - (2.0 * sum(S))
+        rmsdval = E0 - 2.0 * S.sum()
         if full:
             return np.sqrt(abs(rmsdval / L)), np.matmul(V, Wt)
         else:
@@ -693,22 +805,33 @@ class Structure(object):
         :returns: RMSD distance matrix
         '''
 
+        # select points of interest in all frames
+        pts = self.coordinates[:, _normalize_index(points_index)]
+
+        # center all frames, and precompute their sum of squares, once
+        nframes = len(pts)
+        L = pts.shape[1]
+        pts = pts - np.mean(pts, axis=1, keepdims=True)
+        E = np.einsum('fij,fij->f', pts, pts)
+
         if flat:
-            rmsd = []
+            rmsd = np.empty(nframes * (nframes - 1) // 2)
+            k = 0
         else:
-            rmsd = np.zeros((len(self.coordinates), len(self.coordinates)))
+            rmsd = np.zeros((nframes, nframes))
 
-        for i in range(0, len(self.coordinates) - 1, 1):
-            for j in range(i + 1, len(self.coordinates), 1):
-                r = self.rmsd(i, j, points_index)
+        for i in range(0, nframes - 1, 1):
 
-                if flat:
-                    rmsd.append(r)
-                else:
-                    rmsd[i, j] = r
-                    rmsd[j, i] = r
+            # correlation matrices of frame i with all following frames, and
+            # their RMSDs computed at once by QCP (no SVD, nor reflection check)
+            H = np.matmul(pts[i + 1:].transpose(0, 2, 1), pts[i])
+            r = _qcp_rmsd(H, E[i] + E[i + 1:], L)
 
-        if flat:
-            return np.array(rmsd)
-        else:
-            return rmsd
+            if flat:
+                rmsd[k:k + len(r)] = r
+                k += len(r)
+            else:
+                rmsd[i, i + 1:] = r
+                rmsd[i + 1:, i] = r
+
+        return rmsd
@@ -1,8 +1,8 @@
 import os
 import shutil
 import numpy as np
-from distutils.core import setup
-from distutils.command.build_ext import build_ext
+from setuptools import setup
+from setuptools.command.build_ext import build_ext
 from Cython.Build import cythonize
 
 class InstallCommand(build_ext):
@@ -16,8 +16,6 @@
 
 import numpy as np
 cimport numpy as np
-from cpython cimport bool
-import scipy.spatial.distance as S
 
 
 ### HEURISTIC FOR SHORTEST PATH ###
@@ -140,65 +138,73 @@ cdef cython_line_of_sight(np.ndarray access_grid, np.ndarray a, np.ndarray b):
 
 
 ### SASA ###
-cpdef cython_get_surface(np.ndarray points, np.ndarray radii, float probe, int n_sphere_point, float threshold):
-
-    cdef np.ndarray mesh
-    cdef np.ndarray dist
-    cdef np.ndarray test
-    cdef int cnt
-    cdef float asa=0.0
-    cdef float const=4.0*np.pi/n_sphere_point
-    cdef np.ndarray sphere_points
-    cdef bool fail
-    cdef float thethreshold=n_sphere_point*threshold
-    
-    cdef float inc
-    cdef float offset
-    cdef float y
-    cdef float r
-    cdef float phi
-    cdef int k
-
-    #create unit sphere points cloud (using golden spiral)
-    pts = []
-    inc = np.pi*(3-np.sqrt(5))
-    offset =2/float(n_sphere_point)
-    for k in range(int(n_sphere_point)):
-            y=k*offset-1+(offset/2)
-            r=np.sqrt(1 - y*y)
-            phi=k*inc
-            pts.append([np.cos(phi)*r, y, np.sin(phi)*r])
-
-    sphere_points=np.array(pts)
-
-    contact_map=S.cdist(points,points)
-
-    asa=0.0
+cpdef cython_get_surface(np.ndarray points, np.ndarray radii, float probe, np.ndarray sphere_points, float threshold):
+
+    cdef const double[:, ::1] pts = np.ascontiguousarray(points, dtype=np.float64)
+    cdef const double[::1] rad = np.ascontiguousarray(radii, dtype=np.float64)
+    cdef const double[:, ::1] sphere = np.ascontiguousarray(sphere_points, dtype=np.float64)
+    cdef double[::1] rp2
+    cdef int[::1] neigh
+    cdef int n = pts.shape[0]
+    cdef int n_sphere_point = sphere.shape[0]
+    cdef int i, j, k, m, nn, cnt
+    cdef double asa=0.0
+    cdef double const=4.0*np.pi/n_sphere_point
+    cdef double thethreshold=n_sphere_point*threshold
+    cdef double cutoff2
+    cdef double R, mx, my, mz, dx, dy, dz
+    cdef bint buried
+
+    #squared distances are compared throughout, no square root needed
+    cutoff2=(np.max(radii)+probe*2)**2
+    rp2=(np.asarray(rad)+probe)**2
+    neigh=np.empty(n, dtype=np.intc)
+
     surface_atoms=[]
     mesh_pts=[]
     #compute accessible surface for every atom
-    for i in range(0,len(points),1):
-
-            #place mesh points around atom of choice
-            mesh=sphere_points*(radii[i]+probe)+points[i]
-
-            #compute distance matrix between mesh points and neighboring atoms
-            test=np.where(contact_map[i,:]<radii.max()+probe*2)[0]
-            neigh=points[test]
-            dist=S.cdist(neigh,mesh)-radii[test][:,np.newaxis]
-
-            #lines=atoms, columns=mesh points. Count columns containing values greater than probe*2
-            #i.e. allowing sufficient space for a probe to fit completely
+    for i in range(n):
+
+            #list neighboring atoms. The atom itself is excluded: its own mesh points lie exactly
+            #on its probe sphere, and testing them against it would only compare rounding errors
+            nn=0
+            for j in range(n):
+                    if j==i:
+                            continue
+                    dx=pts[j,0]-pts[i,0]
+                    dy=pts[j,1]-pts[i,1]
+                    dz=pts[j,2]-pts[i,2]
+                    if dx*dx+dy*dy+dz*dz<cutoff2:
+                            neigh[nn]=j
+                            nn+=1
+
+            #place mesh points around atom of choice, and count those allowing
+            #sufficient space for a probe to fit completely (stop testing a mesh point at the first clash)
+            R=rad[i]+probe
             cnt=0
-            for m in range(dist.shape[1]):
-                    if not np.any(dist[:,m]<probe):
+            for m in range(n_sphere_point):
+                    mx=sphere[m,0]*R+pts[i,0]
+                    my=sphere[m,1]*R+pts[i,1]
+                    mz=sphere[m,2]*R+pts[i,2]
+
+                    buried=False
+                    for k in range(nn):
+                            j=neigh[k]
+                            dx=pts[j,0]-mx
+                            dy=pts[j,1]-my
+                            dz=pts[j,2]-mz
+                            if dx*dx+dy*dy+dz*dz<rp2[j]:
+                                    buried=True
+                                    break
+
+                    if not buried:
                             cnt+=1
-                            mesh_pts.append(mesh[m])
-            
+                            mesh_pts.append((mx, my, mz))
+
             #calculate asa for current atom, if a sufficient amount of mesh points is exposed (NOTE: to verify)
             if cnt>thethreshold:
                     surface_atoms.append(i)
-                    asa+=const*cnt*(radii[i]+probe)**2
+                    asa+=const*cnt*R*R
 
     return asa, np.array(mesh_pts), np.array(surface_atoms)
 
@@ -218,8 +224,8 @@ def c_heuristic(np.ndarray a, np.ndarray b):
 def c_line_of_sight(np.ndarray access_grid, np.ndarray a, np.ndarray b):
     return cython_line_of_sight(access_grid,a,b)
 
-def c_get_surface(np.ndarray points, np.ndarray radii, float probe, int n_sphere_point, float threshold):
-    return cython_get_surface(points, radii, probe, n_sphere_point, threshold)
+def c_get_surface(np.ndarray points, np.ndarray radii, float probe, np.ndarray sphere_points, float threshold):
+    return cython_get_surface(points, radii, probe, sphere_points, threshold)
 
 def c_ravel(np.ndarray thepos, np.ndarray theshape):
     return cython_ravel(thepos, theshape)
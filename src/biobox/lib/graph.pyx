@@ -111,7 +111,7 @@ cdef class Graph(object):
                     zpos=np.argmin(np.abs(self.zax+self.center[2]-p[2]))
                     grid[xpos,ypos,zpos]=1
     
-                b=scipy.signal.fftconvolve(grid, self.g, mode='same')
+                b=scipy.signal.oaconvolve(grid, self.g, mode='same')
     
                 #accept points where density is under threshold (i.e., region is accessible)
                 self.access_grid=b<np.max(b)-np.std(b)*3
@@ -139,11 +139,11 @@ cdef class Graph(object):
                         grid[xpos,ypos,zpos]=1
             
                     if len(b)==0:                        
-                        b=scipy.signal.fftconvolve(grid, self.g, mode='same')
+                        b=scipy.signal.oaconvolve(grid, self.g, mode='same')
                         b/=np.max(b)
                         b/=ampl
                     else:
-                        b_tmp=scipy.signal.fftconvolve(grid, self.g, mode='same')
+                        b_tmp=scipy.signal.oaconvolve(grid, self.g, mode='same')
                         b_tmp/=np.max(b_tmp)
                         b_tmp/=ampl
                         b+=b_tmp
@@ -211,7 +211,7 @@ cdef class Graph(object):
                                     zpos=np.argmin(np.abs(self.zax+self.center[2]-p[2]))              
                                     grid[xpos,ypos,zpos]=1
                                                 
-                    b=scipy.signal.fftconvolve(grid, self.g, mode='same')
+                    b=scipy.signal.oaconvolve(grid, self.g, mode='same')
     
                     #accept points where density is under threshold (i.e., region is accessible)
                     self.access_grid=b<np.max(b)-np.std(b)*stds
@@ -240,11 +240,11 @@ cdef class Graph(object):
                                         grid[xpos,ypos,zpos]=1
                         
                         if len(b)==0:                        
-                            b=scipy.signal.fftconvolve(grid, self.g, mode='same')
+                            b=scipy.signal.oaconvolve(grid, self.g, mode='same')
                             b/=np.max(b)
                             b/=ampl
                         else:
-                            b_tmp=scipy.signal.fftconvolve(grid, self.g, mode='same')
+                            b_tmp=scipy.signal.oaconvolve(grid, self.g, mode='same')
                             b_tmp/=np.max(b_tmp)
                             b_tmp/=ampl
                             b+=b_tmp
@@ -290,9 +290,9 @@ cdef class Graph(object):
     
                     bestpos=[]
                     bestdist=10000
-                    for x in xrange(i-2,i+3,1):
-                        for y in xrange(j-2,j+3,1):
-                            for z in xrange(k-2,k+3,1):
+                    for x in range(i-2,i+3,1):
+                        for y in range(j-2,j+3,1):
+                            for z in range(k-2,k+3,1):
     
                                 if x>=self.access_grid_shape[0] or y>=self.access_grid_shape[1] or z>=self.access_grid_shape[2]:
                                     continue
@@ -315,19 +315,19 @@ cdef class Graph(object):
                     dists.append(bestdist)
                 
                 '''
-                print idx, dists
+                print(idx, dists)
                 
                 #cdef np.ndarray w=np.array(np.where(self.access_grid)).T
                 #cdef np.ndarray points=self.get_points_from_idx(w)
                 idx=[]
                 dists=[]
 
-                for i in xrange(0,len(target),1):
+                for i in range(0,len(target),1):
                         pos=np.argmin(d[i])
                         idx.append(self.w[pos])
                         dists.append(np.min(d[i]))
                 
-                print idx, dists
+                print(idx, dists)
                 '''
                     
                 return dists, np.array(idx)
@@ -344,9 +344,9 @@ cdef class Graph(object):
                 cdef list n=[]
                 cdef list p=self.get_3d_index(idx)
 
-                for x in xrange(p[0]-1,p[0]+2,1):
-                    for y in xrange(p[1]-1,p[1]+2,1):
-                        for z in xrange(p[2]-1,p[2]+2,1):
+                for x in range(p[0]-1,p[0]+2,1):
+                    for y in range(p[1]-1,p[1]+2,1):
+                        for z in range(p[2]-1,p[2]+2,1):
 
                             if x==p[0] and y==p[1] and z==p[2]:
                                 continue
@@ -426,12 +426,14 @@ cdef class Graph(object):
                 x_ = np.arange(-m,m+1,1).astype(int)
                 y_ = np.arange(-n,n+1,1).astype(int)
                 z_ = np.arange(-k,k+1,1).astype(int)
-                x, y, z = np.meshgrid(x_, y_, z_)
 
-                h = np.exp( -(x*x + y*y + z*z) / (2.*sigma*sigma) )
-                h[ h < np.finfo(h.dtype).eps*h.max() ] = 0
+                # separable kernel: outer product of 1D gaussians
+                g = np.exp( -(x_*x_) / (2.*sigma*sigma) )
+                h = np.multiply.outer(np.multiply.outer(g, g), g)
+                # drop negligible values, and normalize
+                np.multiply(h, h >= np.finfo(h.dtype).eps*h.max(), out=h)
                 sumh = h.sum()
                 if sumh != 0:
-                    h /= sumh
+                    h *= 1.0/sumh
 
                 return h
@@ -20,8 +20,10 @@ import os
 import sys
 import random
 import string
+from functools import lru_cache
 
 import numpy as np
+from scipy.spatial import cKDTree
 from ctypes import cdll, c_int, c_float, byref
 
 import biobox.lib.fastmath as FM  # cython routines
@@ -55,10 +57,13 @@ def sasa_c(M, targets=[], probe=1.4, n_sphere_point=960, threshold=0.05):
     if threshold < 0.0 or threshold > 1.0:
         raise Exception("ERROR: threshold should be a floating point between 0 and 1!")
 
+    # unit sphere points cloud, shared with sasa
+    sphere_points = _golden_sphere(int(n_sphere_point))
+
     if len(targets) == 0:
-        return FM.c_get_surface(M.points, radii, probe, n_sphere_point, threshold)
+        return FM.c_get_surface(M.points, radii, probe, sphere_points, threshold)
     else:
-        return FM.c_get_surface(M.points[targets], radii, probe, n_sphere_point, threshold)
+        return FM.c_get_surface(M.points[targets], radii, probe, sphere_points, threshold)
 
 def sasa(M, targets=[], probe=1.4, n_sphere_point=960, threshold=0.05):
     '''
@@ -94,50 +99,74 @@ def sasa(M, targets=[], probe=1.4, n_sphere_point=960, threshold=0.05):
         raise Exception("ERROR: threshold should be a floating point between 0 and 1!")
 
     # create unit sphere points cloud (using golden spiral)
-    pts = []
-    inc = np.pi * (3 - np.sqrt(5))
-    offset = 2 / float(n_sphere_point)
-    for k in range(int(n_sphere_point)):
-        y = k * offset - 1 + (offset / 2)
-        r = np.sqrt(1 - y * y)
-        phi = k * inc
-        pts.append([np.cos(phi) * r, y, np.sin(phi) * r])
-
-    sphere_points = np.array(pts)
+    sphere_points = _golden_sphere(int(n_sphere_point))
     const = 4.0 * np.pi / len(sphere_points)
 
-    contact_map = I.distance_matrix(M.points, M.points)
+    # loop-invariant quantities: neighbors search cutoff, radii of probe
+    # spheres centered on atoms, and minimal count of exposed mesh points
+    cutoff = radii.max() + probe * 2
+    probe_radii = radii + probe
+    min_exposed = n_sphere_point * threshold
+
+    # list atoms neighboring every target (no need for a full distance matrix)
+    tree = cKDTree(M.points)
+    neighbors = tree.query_ball_point(M.points[np.asarray(targets)], r=cutoff)
 
     asa = 0.0
     surface_atoms = []
     mesh_pts = []
     # compute accessible surface for every atom
-    for i in targets:
+    for i, nb in zip(targets, neighbors):
 
         # place mesh points around atom of choice
-        mesh = sphere_points * (radii[i] + probe) + M.points[i]
+        mesh = sphere_points * probe_radii[i] + M.points[i]
 
-        # compute distance matrix between mesh points and neighboring atoms
-        test = np.where(contact_map[i, :] < radii.max() + probe * 2)[0]
+        # compute distance matrix between mesh points and neighboring atoms.
+        # The atom itself is excluded: its mesh points lie exactly on its
+        # probe sphere, testing them would only compare rounding errors
+        test = np.asarray(nb, dtype=int)
+        test = test[test != i]
         neigh = M.points[test]
         dist = I.distance_matrix(neigh, mesh) - radii[test][:, np.newaxis]
 
         # lines=atoms, columns=mesh points. Count columns containing values greater than probe*2
         # i.e. allowing sufficient space for a probe to fit completely
-        cnt = 0
-        for m in range(dist.shape[1]):
-            if not np.any(dist[:, m] < probe):
-                cnt += 1
-                mesh_pts.append(mesh[m])
+        exposed = ~np.any(dist < probe, axis=0)
+        cnt = np.count_nonzero(exposed)
+        if cnt > 0:
+            mesh_pts.append(mesh[exposed])
 
         # calculate asa for current atom, if a sufficient amount of mesh
         # points is exposed (NOTE: to verify)
-        if cnt > n_sphere_point * threshold:
+        if cnt > min_exposed:
             surface_atoms.append(i)
-            asa += const * cnt * (radii[i] + probe)**2
+            asa += const * cnt * probe_radii[i]**2
+
+    if len(mesh_pts) > 0:
+        mesh_pts = np.concatenate(mesh_pts)
 
     return asa, np.array(mesh_pts), np.array(surface_atoms)
 
+@lru_cache(maxsize=8)
+def _golden_sphere(n_sphere_point):
+    '''
+    create a cloud of points evenly distributed on a unit sphere (using golden spiral).
+    Results are cached, the returned array is read-only.
+
+    :param n_sphere_point: number of points
+    :returns: n_sphere_point x 3 numpy array
+    '''
+    k = np.arange(n_sphere_point)
+    offset = 2 / float(n_sphere_point)
+    y = k * offset - 1 + (offset / 2)
+    r = np.sqrt(1 - y * y)
+    inc = np.pi * (3 - np.sqrt(5))
+    phi = k * inc
+
+    pts = np.column_stack((np.cos(phi) * r, y, np.sin(phi) * r))
+    pts.flags.writeable = False
+    return pts
+
 def rgyr(M):
     '''
     compute radius of gyration.
@@ -154,8 +183,8 @@ def rgyr(M):
     elif this_inst in ["Assembly", "Polyhedra"]:
         M = M.make_structure()
 
-    d_square = np.sum((M.points - M.get_center())**2, axis=1)
-    return np.sqrt(np.sum(d_square) / d_square.shape[0])
+    diff = M.points - M.get_center()
+    return np.sqrt(np.einsum('ij,ij->', diff, diff) / diff.shape[0])
 
 
 def saxs(M, crysol_path='', crysol_options="-lm 20 -ns 500", pdbname=""):
@@ -410,5 +439,4 @@ def random_string(length=32):
 
     :param length: length of random string
     '''
-    return ''.join([random.choice(string.ascii_letters)
-                    for n in range(length)])
+    return ''.join(random.choices(string.ascii_letters, k=length))
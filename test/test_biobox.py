@@ -1,5 +1,8 @@
 import unittest
 import sys, os
+from copy import copy, deepcopy
+import pickle
+import numpy as np
 if 'CONDA_BUILD_STATE' in os.environ and os.environ['CONDA_BUILD_STATE']=='TEST':
     pass
 else:
@@ -74,6 +77,15 @@ class test_structures(unittest.TestCase):
         except Exception:
             assert False
 
+        # each atom is excluded from its own neighbors. Python and compiled
+        # implementations share the same unit sphere, and must agree
+        [sasa1, mesh1, surf_idx1] = bb.sasa(self.M, n_sphere_point=200)
+        [sasa2, mesh2, surf_idx2] = bb.sasa_c(self.M, n_sphere_point=200)
+        self.assertAlmostEqual(sasa1, 11411.95, delta=0.01)
+        self.assertAlmostEqual(sasa1, sasa2, delta=0.01)
+        self.assertEqual(len(mesh1), len(mesh2))
+        self.assertTrue(np.array_equal(np.sort(surf_idx1), np.sort(surf_idx2)))
+
 
     def test_monomer_CCS(self):
         if 'IMPACTPATH' in os.environ:
@@ -163,6 +175,210 @@ class test_structures(unittest.TestCase):
             assert False
 
 
+    #points pointer must follow coordinates, also on copied structures
+    def test_deepcopy_rototranslations(self):
+
+        print("\n> testing rototranslations of a copied monomer")
+        M2 = deepcopy(self.M)
+        M2.rotate(10, 20, 30)
+        self.assertTrue(np.allclose(M2.coordinates[M2.current], M2.points))
+        self.assertFalse(np.allclose(M2.points, self.M.points))
+
+        M2.align_axes()
+        self.assertTrue(np.allclose(M2.coordinates[M2.current], M2.points))
+
+        M2.translate(5, 5, 5)
+        self.assertTrue(np.allclose(M2.coordinates[M2.current], M2.points))
+
+        X = np.random.rand(len(M2), 3)
+        M3 = deepcopy(M2)
+        M3.set_xyz(X)
+        self.assertTrue(np.allclose(M3.get_xyz(), X))
+        self.assertTrue(np.allclose(M3.coordinates[M3.current], X))
+
+        P = bb.Multimer()
+        P.setup_polyhedron("Octahedron", self.M)
+        B = P.building_block
+        self.assertTrue(np.allclose(B.coordinates[B.current], B.points))
+
+
+    #transforming all frames at once must match a per-frame transformation
+    def test_transformation_all_frames(self):
+
+        print("\n> testing transformation of all frames")
+        np.random.seed(0)
+        M = np.random.rand(3, 3)
+        S1 = bb.Structure(np.random.rand(4, 50, 3))
+        S2 = deepcopy(S1)
+
+        S1.apply_transformation(M, all_frames=True)
+        for i in range(len(S2.coordinates)):
+            S2.set_current(i)
+            S2.apply_transformation(M)
+
+        self.assertTrue(np.allclose(S1.coordinates, S2.coordinates))
+        self.assertTrue(np.allclose(S1.coordinates[S1.current], S1.points))
+
+
+    #adding, deleting and clearing conformations
+    def test_conformations_database(self):
+
+        print("\n> testing conformations database")
+        np.random.seed(0)
+        frames = np.random.rand(8, 10, 3)
+        S = bb.Structure(frames[0])
+
+        # add frames one at a time (buffer reallocated several times)
+        for i in range(1, 5):
+            S.add_xyz(frames[i])
+            self.assertEqual(S.current, i)
+            self.assertTrue(np.allclose(S.points, frames[i]))
+            self.assertTrue(np.shares_memory(S.points, S.coordinates))
+
+        # add several frames at once, points move to the first new one
+        S.add_xyz(frames[5:8])
+        self.assertEqual(S.coordinates.shape, (8, 10, 3))
+        self.assertTrue(np.allclose(S.coordinates, frames))
+        self.assertTrue(np.allclose(S.points, frames[5]))
+
+        # integer coordinates are stored as double precision
+        S.add_xyz(np.ones((10, 3), dtype=int))
+        self.assertEqual(S.coordinates.dtype, np.float64)
+        S.delete_xyz(8)
+
+        # delete a frame, and keep adding after it
+        S.delete_xyz(2)
+        expected = np.delete(frames, 2, axis=0)
+        self.assertTrue(np.allclose(S.coordinates, expected))
+        self.assertTrue(np.allclose(S.points, frames[1]))
+        S.add_xyz(frames[2])
+        self.assertTrue(np.allclose(S.coordinates, np.concatenate([expected, frames[2:3]])))
+        self.assertTrue(np.shares_memory(S.points, S.coordinates))
+
+        # modifying points must modify the database
+        before = S.coordinates[S.current].copy()
+        S.points += 1.0
+        self.assertTrue(np.allclose(S.coordinates[S.current], before + 1.0))
+
+        # restart from an empty database
+        S.clear()
+        self.assertEqual(S.coordinates.size, 0)
+        S.add_xyz(frames[0])
+        self.assertEqual(S.coordinates.shape, (1, 10, 3))
+        self.assertTrue(np.allclose(S.points, frames[0]))
+
+
+    #copies and pickles must not carry the spare rows of the coordinates buffer
+    def test_copy_and_pickle_coordinates(self):
+
+        print("\n> testing copy and pickle of conformations database")
+        np.random.seed(0)
+        frames = np.random.rand(3, 10, 3)
+        S = bb.Structure(frames[0])
+        S.add_xyz(frames[1])
+        S.add_xyz(frames[2])
+        self.assertGreater(len(S._coordinates), len(S.coordinates))
+
+        # frames added to a shallow copy must not end up in the original
+        S2 = copy(S)
+        S.add_xyz(np.full((10, 3), 7.0))
+        S2.add_xyz(np.full((10, 3), 9.0))
+        self.assertTrue(np.allclose(S.coordinates[3], 7.0))
+        self.assertTrue(np.allclose(S2.coordinates[3], 9.0))
+        self.assertTrue(np.allclose(S.points, 7.0))
+
+        # deep copies and pickles store the available frames only
+        for S3 in [deepcopy(S2), pickle.loads(pickle.dumps(S2))]:
+            self.assertEqual(len(S3._coordinates), 4)
+            self.assertTrue(np.allclose(S3.coordinates, S2.coordinates))
+            self.assertTrue(np.shares_memory(S3.points, S3.coordinates))
+
+        # objects pickled before the buffer was introduced
+        state = S2.__getstate__()
+        state['coordinates'] = state.pop('_coordinates')
+        del state['_nframes']
+        S4 = bb.Structure.__new__(bb.Structure)
+        S4.__setstate__(state)
+        self.assertTrue(np.allclose(S4.coordinates, S2.coordinates))
+        S4.add_xyz(frames[0])
+        self.assertEqual(S4.coordinates.shape, (5, 10, 3))
+        self.assertTrue(np.allclose(S4.points, frames[0]))
+
+
+    #RMSD of whole ensembles (QCP) must match pairwise Kabsch alignment
+    def test_rmsd_one_vs_all(self):
+
+        print("\n> testing RMSD against a reference")
+        np.random.seed(0)
+        X = np.random.rand(30, 3) * 10
+        frames = [X]
+        for i in range(5):
+            R = np.linalg.qr(np.random.randn(3, 3))[0]
+            if np.linalg.det(R) < 0:
+                R[:, 0] *= -1
+            frames.append(np.dot(X, R) + np.random.randn(30, 3) * 0.01 + i)
+        frames.append(X * np.array([-1, 1, 1])) # reflected frame
+        S = bb.Structure(np.array(frames))
+
+        # all points, collinear (2 points) and planar (3 points) selections
+        for idx in [[], [3, 7], [1, 2, 5]]:
+            rmsd = S.rmsd_one_vs_all(0, points_index=idx)
+            for i in range(1, len(frames)):
+                kabsch = S.rmsd(0, i, points_index=idx, full=True)[0]
+                self.assertAlmostEqual(rmsd[i], kabsch, delta=1e-6)
+                self.assertAlmostEqual(S.rmsd(0, i, points_index=idx), kabsch, delta=1e-9)
+
+        # a reflection is not a valid superposition
+        self.assertGreater(S.rmsd_one_vs_all(0)[-1], 1.0)
+
+
+    #after alignment, RMSD of frames must be the one returned
+    def test_rmsd_align(self):
+
+        print("\n> testing alignment of all frames on a reference")
+        np.random.seed(1)
+        X = np.random.rand(40, 3) * 10
+        frames = [X]
+        for i in range(4):
+            R = np.linalg.qr(np.random.randn(3, 3))[0]
+            frames.append(np.dot(X, R) + np.random.randn(40, 3) * 0.5 + i)
+        frames.append(X * np.array([1, -1, 1]) + 3) # reflected frame
+        S = bb.Structure(np.array(frames))
+
+        rmsd = S.rmsd_one_vs_all(0, align=True)
+        for i in range(len(frames)):
+            actual = np.sqrt(np.mean(np.sum((S.coordinates[i] - S.coordinates[0])**2, axis=1)))
+            self.assertAlmostEqual(rmsd[i], actual, delta=1e-6)
+
+        # the reflected frame cannot be superimposed by a rotation
+        self.assertGreater(rmsd[-1], 1.0)
+
+
+    #RMSD distance matrix on collinear frames (degenerate for QCP)
+    def test_rmsd_distance_matrix(self):
+
+        print("\n> testing RMSD distance matrix")
+        np.random.seed(0)
+        line = np.outer(np.linspace(0, 10, 15), [1.0, 2.0, 3.0])
+        frames = [line + np.random.randn(15, 3) * 1e-4 for i in range(4)]
+        frames.append(line[::-1] * 1.001)
+        S = bb.Structure(np.array(frames))
+
+        dm = S.rmsd_distance_matrix()
+        flat = S.rmsd_distance_matrix(flat=True)
+        self.assertTrue(np.allclose(dm, dm.T))
+        self.assertTrue(np.allclose(flat, dm[np.triu_indices(len(frames), 1)]))
+
+        for i in range(len(frames)):
+            for j in range(i + 1, len(frames)):
+                # RMSD measured after actually superimposing the two frames
+                r, R = S.rmsd(i, j, full=True)
+                m1 = S.coordinates[i] - np.mean(S.coordinates[i], axis=0)
+                m2 = S.coordinates[j] - np.mean(S.coordinates[j], axis=0)
+                direct = np.sqrt(np.sum((np.dot(m2, R) - m1)**2) / len(m1))
+                self.assertAlmostEqual(dm[i, j], direct, delta=1e-6)
+
+
     #test assembly of multiple polyhedral architectures, and RMSD evaluation
     def test_polyRMSD(self):
 